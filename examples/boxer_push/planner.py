@@ -1,10 +1,15 @@
 from mppiisaac.planner.mppi_isaac import MPPIisaacPlanner
 from mppiisaac.utils.config_store import ExampleConfig
 from mppiisaac.utils.conversions import quaternion_to_yaw
+from mppiisaac.utils.transport import ActionServer, remove_stale_ipc_endpoint
 import hydra
 import torch
 import zerorpc
 
+# Planner and world run on the same host, so use unix domain sockets instead of tcp over loopback
+PLANNER_ADDRESS = "ipc:///tmp/mppi-boxer.sock"
+ACTION_ADDRESS = "ipc:///tmp/mppi-boxer-action.sock"
+
 
 class Objective(object):
     def __init__(self, cfg):
@@ -70,8 +75,12 @@ class Objective(object):
 @hydra.main(version_base=None, config_path=".", config_name="config_boxer_push")
 def run_boxer_robot(cfg: ExampleConfig):
     objective = Objective(cfg)
-    planner = zerorpc.Server(MPPIisaacPlanner(cfg, objective, prior=None))
-    planner.bind("tcp://0.0.0.0:4242")
+    mppi_planner = MPPIisaacPlanner(cfg, objective, prior=None)
+    for address in (PLANNER_ADDRESS, ACTION_ADDRESS):
+        remove_stale_ipc_endpoint(address)
+    planner = zerorpc.Server(mppi_planner)
+    planner.bind(PLANNER_ADDRESS)
+    ActionServer(mppi_planner, ACTION_ADDRESS).spawn()
     planner.run()
 
 
@@ -2,10 +2,16 @@ from mppiisaac.planner.isaacgym_wrapper import IsaacGymWrapper
 import hydra
 import zerorpc
 from mppiisaac.utils.config_store import ExampleConfig
-from mppiisaac.utils.transport import torch_to_bytes, bytes_to_torch
+from mppiisaac.utils.transport import ActionClient, SharedTensor, attach_shared_tensor
+import threading
 import time
+import torch
 from isaacgym import gymapi
 
+PLANNER_ADDRESS = "ipc:///tmp/mppi-boxer.sock"
+ACTION_ADDRESS = "ipc:///tmp/mppi-boxer-action.sock"
+FPS_PRINT_INTERVAL = 50
+
 
 @hydra.main(version_base=None, config_path=".", config_name="config_boxer_push")
 def reach(cfg: ExampleConfig):
@@ -22,45 +28,141 @@ def reach(cfg: ExampleConfig):
         sim.viewer, None, gymapi.Vec3(1.5, 2, 3), gymapi.Vec3(1.5, 0, 0)
     )
 
-    sim._gym.subscribe_viewer_keyboard_event(sim.viewer, gymapi.KEY_A, "left")
-    sim._gym.subscribe_viewer_keyboard_event(sim.viewer, gymapi.KEY_S, "down")
-    sim._gym.subscribe_viewer_keyboard_event(sim.viewer, gymapi.KEY_D, "right")
-    sim._gym.subscribe_viewer_keyboard_event(sim.viewer, gymapi.KEY_W, "up")
-
     planner = zerorpc.Client()
-    planner.connect("tcp://127.0.0.1:4242")
+    planner.connect(PLANNER_ADDRESS)
     print("Mppi server found!")
 
-    t = time.time()
-
-    while True:
-        # Compute action
-        action = bytes_to_torch(
-            planner.compute_action_tensor(
-                torch_to_bytes(sim._dof_state), torch_to_bytes(sim._root_state)
-            )
-        )
-
-        # Apply action
-        sim.apply_robot_cmd(action)
-
-        # Step simulator
-        sim.step()
-
-        # Visualize samples
-        rollouts = bytes_to_torch(planner.get_rollouts())
-        sim._gym.clear_lines(sim.viewer)
-        sim.draw_lines(rollouts)
-
-        # Timekeeping
-        actual_dt = time.time() - t
-        rt = cfg.isaacgym.dt / actual_dt
-        if rt > 1.0:
-            time.sleep(cfg.isaacgym.dt - actual_dt)
-            actual_dt = time.time() - t
-            rt = cfg.isaacgym.dt / actual_dt
-        print(f"FPS: {1/actual_dt}, RT={rt}")
-        t = time.time()
+    # Exchange states, actions and rollouts through shared memory, zerorpc only carries the control messages and the
+    # per step call goes over a bare zmq socket
+    dof_state_shm = SharedTensor.create(sim._dof_state.shape, sim._dof_state.dtype)
+    root_state_shm = SharedTensor.create(sim._root_state.shape, sim._root_state.dtype)
+    specs = planner.open_shared_buffers(dof_state_shm.spec(), root_state_shm.spec())
+    action_shm = SharedTensor.attach(specs["action"])
+    # Note: the rollouts are mapped from the planner's device memory when it runs on the gpu
+    rollouts_shm = attach_shared_tensor(specs["rollouts"])
+
+    # Bind everything the loop touches to locals, the tensors are persistent so binding them once is fine
+    dof_state, root_state = sim._dof_state, sim._root_state
+    dof_state_buf, root_state_buf = dof_state_shm.tensor, root_state_shm.tensor
+    action_buf, rollouts_buf = action_shm.tensor, rollouts_shm.tensor
+    apply_robot_cmd, step, draw_lines = sim.apply_robot_cmd, sim.step, sim.draw_lines
+    compute_action = ActionClient(ACTION_ADDRESS).compute_action
+    async_planning = cfg.async_planning
+    dt = cfg.isaacgym.dt
+    perf_counter, sleep = time.perf_counter, time.sleep
+
+    # With async_planning a worker thread keeps the planner busy on the latest state and the loop applies whatever
+    # action is newest, so rendering never waits on the planner. Access to the staged states, latest action and the
+    # error the worker stopped on is guarded by the lock.
+    lock = threading.Lock()
+    action_ready = threading.Event()
+    state_staged = threading.Event()
+    dof_state_staging = dof_state.cpu()
+    root_state_staging = root_state.cpu()
+    latest = {"action": torch.empty_like(action_buf), "n_rollout_steps": None, "new_rollouts": False, "error": None}
+
+    # Pinned so apply_robot_cmd can upload the action asynchronously. The next overwrite happens after the state
+    # copies of the following frame, which synchronize the stream.
+    action = torch.empty_like(action_buf).pin_memory()
+
+    def planner_worker():
+        # zmq sockets are not thread safe, so the worker gets its own client
+        client = ActionClient(ACTION_ADDRESS)
+        try:
+            while True:
+                state_staged.wait()
+                with lock:
+                    state_staged.clear()
+                    # The buffers still hold the last planned state, an unchanged state (e.g. a paused simulator)
+                    # would only give the same action again
+                    if (
+                        latest["n_rollout_steps"] is not None
+                        and torch.equal(dof_state_buf, dof_state_staging)
+                        and torch.equal(root_state_buf, root_state_staging)
+                    ):
+                        continue
+                    dof_state_buf.copy_(dof_state_staging)
+                    root_state_buf.copy_(root_state_staging)
+                n_rollout_steps = client.compute_action()
+                with lock:
+                    latest["action"].copy_(action_buf)
+                    latest["n_rollout_steps"] = n_rollout_steps
+                    latest["new_rollouts"] = True
+                action_ready.set()
+        except Exception as e:
+            # e.g. a TimeoutError of the client, handed to the main loop so it doesn't keep applying a stale action
+            with lock:
+                latest["error"] = e
+            action_ready.set()
+
+    # Warm up the planner connection and its lazy initialisation, so the first frames don't throw off the pacing
+    dof_state_buf.copy_(dof_state)
+    root_state_buf.copy_(root_state)
+    for _ in range(3):
+        compute_action()
+
+    if async_planning:
+        state_staged.set()
+        threading.Thread(target=planner_worker, daemon=True).start()
+        action_ready.wait()
+
+    frame = 0
+    t = deadline = perf_counter()
+
+    try:
+        while True:
+            # Compute action
+            if async_planning:
+                with lock:
+                    if latest["error"] is not None:
+                        raise RuntimeError("The planner thread stopped") from latest["error"]
+                    action.copy_(latest["action"])
+                    n_rollout_steps = latest["n_rollout_steps"]
+                    new_rollouts = latest["new_rollouts"]
+                    latest["new_rollouts"] = False
+            else:
+                dof_state_buf.copy_(dof_state)
+                root_state_buf.copy_(root_state)
+                n_rollout_steps = compute_action()
+                action.copy_(action_buf)
+                new_rollouts = True
+
+            # Apply action
+            apply_robot_cmd(action)
+
+            # Step simulator
+            step()
+
+            if async_planning:
+                with lock:
+                    dof_state_staging.copy_(dof_state)
+                    root_state_staging.copy_(root_state)
+                state_staged.set()
+
+            # Visualize samples, only redrawn when the planner produced new ones since the viewer keeps the old lines.
+            # In async mode the planner may be rewriting them, which only affects the drawing.
+            if new_rollouts:
+                draw_lines(rollouts_buf[:n_rollout_steps], clear=True)
+
+            # Timekeeping, sleep until a monotonic deadline so sleep overshoot doesn't accumulate
+            now = perf_counter()
+            frame += 1
+            if frame % FPS_PRINT_INTERVAL == 0:
+                actual_dt = (now - t) / FPS_PRINT_INTERVAL
+                t = now
+                print(f"FPS: {1/actual_dt}, RT={dt / actual_dt}")
+
+            deadline += dt
+            slack = deadline - now
+            if slack > 0:
+                sleep(slack)
+            else:
+                # Running behind, don't try to catch up with a burst of frames
+                deadline = now
+    finally:
+        planner.close_shared_buffers()
+        for buf in (dof_state_shm, root_state_shm, action_shm, rollouts_shm):
+            buf.close()
 
 
 if __name__ == "__main__":
@@ -51,8 +51,6 @@ def run_heijn_robot(cfg: ExampleConfig):
         rt = cfg.isaacgym.dt / actual_dt
         if rt > 1.0:
             time.sleep(cfg.isaacgym.dt - actual_dt)
-            actual_dt = time.time() - t
-            rt = cfg.isaacgym.dt / actual_dt
         print(f"FPS: {1/actual_dt}, RT={rt}")
         t = time.time()
 
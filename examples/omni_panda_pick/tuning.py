@@ -79,7 +79,8 @@ class Tuning:
             action = bytes_to_torch(
                 self.planner.compute_action_tensor(
                     torch_to_bytes(self.sim._dof_state), torch_to_bytes(self.sim._root_state)
-                )
+                ),
+                device=self.sim.device,
             )
 
             # Apply action
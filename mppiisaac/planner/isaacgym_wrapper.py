@@ -1,6 +1,7 @@
 from isaacgym import gymapi
 from isaacgym import gymtorch
 from dataclasses import dataclass, field
+import math
 import torch
 import numpy as np
 from enum import Enum
@@ -80,6 +81,17 @@ class ActorWrapper:
 from mppiisaac.utils.isaacgym_utils import load_asset, add_ground_plane, load_actor_cfgs
 
 
+def _as_slice(indices: List[int]) -> Optional[slice]:
+    """
+    Returns the equivalent slice if the indices form a contiguous ascending range, otherwise None.
+    """
+    if not indices:
+        return slice(0, 0)
+    if indices != list(range(indices[0], indices[-1] + 1)):
+        return None
+    return slice(indices[0], indices[-1] + 1)
+
+
 class IsaacGymWrapper:
     def __init__(
         self,
@@ -111,6 +123,16 @@ class IsaacGymWrapper:
         self.interactive_goal = interactive_goal
         self.num_envs = num_envs
         self.restarted = 1
+
+        # Line buffers for draw_lines, grown on demand and reused across frames
+        self._line_vertices = None
+        self._line_colors = None
+        self._line_staging: Optional[torch.Tensor] = None
+
+        # step() only refreshes the rigid body and contact force tensors once something reads them, see request_*
+        self._needs_rigid_body_refresh = False
+        self._needs_contact_force_refresh = False
+
         self.start_sim()
 
     def initialize_keyboard_listeners(self):
@@ -163,6 +185,12 @@ class IsaacGymWrapper:
             asset = load_asset(self._gym, self._sim, actor_cfg)
             env_actor_assets.append(asset)
 
+        # Draw the mass and friction noise of every actor for all envs at once, _create_actor only indexes into it
+        env_actor_noise = [
+            self._draw_actor_noise(actor_cfg, asset)
+            for asset, actor_cfg in zip(env_actor_assets, self.env_cfg)
+        ]
+
         # Create envs and fill with assets
         self.envs = []
         for env_idx in range(self.num_envs):
@@ -173,9 +201,9 @@ class IsaacGymWrapper:
                 int(self.num_envs**0.5),
             )
 
-            for actor_asset, actor_cfg in zip(env_actor_assets, self.env_cfg):
+            for actor_asset, actor_cfg, actor_noise in zip(env_actor_assets, self.env_cfg, env_actor_noise):
                 actor_cfg.handle = self._create_actor(
-                    env, env_idx, actor_asset, actor_cfg
+                    env, env_idx, actor_asset, actor_cfg, actor_noise
                 )
             self.envs.append(env)
 
@@ -190,6 +218,8 @@ class IsaacGymWrapper:
         self._dof_state = gymtorch.wrap_tensor(
             self._gym.acquire_dof_state_tensor(self._sim)
         ).view(self.num_envs, -1)
+        # same storage as (num_envs, num_dofs, [pos, vel])
+        self._dof_state_3d = self._dof_state.view(self.num_envs, -1, 2)
         self._rigid_body_state = gymtorch.wrap_tensor(
             self._gym.acquire_rigid_body_state_tensor(self._sim)
         ).view(self.num_envs, -1, 13)
@@ -198,158 +228,331 @@ class IsaacGymWrapper:
             self._gym.acquire_net_contact_force_tensor(self._sim)
         ).view(self.num_envs, -1, 3)
 
-        # save buffer of ee states
-        if self._visualize_link_present:
-            self.visualize_link_buffer = []
+        # name -> actor index lookup, so lookups don't scan env_cfg
+        self._name_to_idx = {a.name: i for i, a in enumerate(self.env_cfg)}
+
+        # (actor name, link name) -> rigid body index in the env, for the link and contact force getters
+        self._link_rigid_body_index = {}
+        for a in self.env_cfg:
+            for link in self._gym.get_actor_rigid_body_names(self.envs[0], a.handle):
+                self._link_rigid_body_index[(a.name, link)] = self._gym.find_actor_rigid_body_index(
+                    self.envs[0], a.handle, link, gymapi.IndexDomain.DOMAIN_ENV
+                )
+
+        # actors whose root state was written by the single actor setters, pushed to the sim in one call by step()
+        self._pending_root_writes = []
+        self._pending_indices_tensor = torch.empty(len(self.env_cfg), dtype=torch.int32, device=self.device)
 
         # helpfull slices
-        self.robot_indices = torch.tensor([i for i, a in enumerate(self.env_cfg) if a.type == "robot"], device=self.device)
-        self.obstacle_indices = torch.tensor([i for i, a in enumerate(self.env_cfg) if (a.type in ["sphere", "box"] and a.name != "dummy")], device=self.device)
+        self._robot_actor_indices = [i for i, a in enumerate(self.env_cfg) if a.type == "robot"]
+        obstacle_actor_indices = [i for i, a in enumerate(self.env_cfg) if (a.type in ["sphere", "box"] and a.name != "dummy")]
+        # int32 like the indices the gym *_indexed calls take, index_select accepts them as well
+        self.robot_indices = torch.tensor(self._robot_actor_indices, dtype=torch.int32, device=self.device)
+        self.obstacle_indices = torch.tensor(obstacle_actor_indices, dtype=torch.int32, device=self.device)
+        # robots and obstacles are normally contiguous ranges of actors, which can be read as views without a gather
+        self._robot_slice = _as_slice(self._robot_actor_indices)
+        self._obstacle_slice = _as_slice(obstacle_actor_indices)
+        # non robot actors that can be moved, in actor order, the rows of update_root_state_tensor_by_obstacles_tensor
+        self._movable_obstacle_indices = [i for i, a in enumerate(self.env_cfg) if a.type != "robot" and not a.fixed]
+
+        # initial root states of all actors in actor order, broadcast over the envs by reset_to_initial_poses
+        self._initial_root_state = torch.tensor(
+            [[*a.init_pos, *a.init_ori, *[0] * 6] for a in self.env_cfg],
+            dtype=torch.float32,
+            device=self.device,
+        )
 
         if self._visualize_link_present:
             self.visualize_link_pos = self._rigid_body_state[
                 :, self.robot_rigid_body_viz_idx, 0:3
             ]  # [x, y, z]
+            # save buffer of ee states, one row per step since the last reset. It grows on demand and is reused after
+            # that, so steps don't allocate.
+            # the visualize link positions are a view on the rigid body states
+            self._needs_rigid_body_refresh = True
+            self._visualize_link_buffer = torch.empty(
+                (0,) + tuple(self.visualize_link_pos.shape), device=self.device
+            )
+            self._viz_step = 0
 
         self._gym.refresh_actor_root_state_tensor(self._sim)
         self._gym.refresh_dof_state_tensor(self._sim)
         self._gym.refresh_rigid_body_state_tensor(self._sim)
         self._gym.refresh_net_contact_force_tensor(self._sim)
 
-        # set initial joint poses
-        robots = [a for a in self.env_cfg if a.type == "robot"]
-        for robot in robots:
-            dof_state = []
+        self._cache_robot_dofs()
+
+        # persistent buffer the dof state resets broadcast into, instead of allocating a repeated tensor per reset
+        self._dof_state_buffer = torch.empty_like(self._dof_state)
+        # pinned host staging for the (num_dofs, 2) rows reset_robot_state uploads, the event marks when the last upload
+        # from it finished so it isn't overwritten while the copy is in flight
+        use_cuda = self.device.startswith("cuda")
+        self._dof_reset_staging = torch.empty(self._dof_state_3d.shape[1:], dtype=torch.float32, pin_memory=use_cuda)
+        self._dof_reset_event = torch.cuda.Event() if use_cuda else None
+
+        # set initial joint poses, the interleaved pos, vel states of all robots in actor order
+        dof_state = []
+        for robot, dof_count in zip(self._robots, self._robot_dof_counts):
             if robot.init_joint_pose:
                 dof_state += robot.init_joint_pose
-                print(dof_state)
             else:
-                dof_state += (
-                    [0] * 2 * self._gym.get_actor_dof_count(self.envs[0], robot.handle)
-                )
-        dof_state = (
-            torch.tensor(dof_state, device=self.device)
-            .type(torch.float32)
-            .repeat(self.num_envs, 1)
-        )
-        self._gym.set_dof_state_tensor(self._sim, gymtorch.unwrap_tensor(dof_state))
+                dof_state += [0] * 2 * dof_count
+        self._initial_dof_state = torch.tensor(dof_state, dtype=torch.float32, device=self.device)
+        self._set_dof_state_all_envs(self._initial_dof_state)
         self._gym.refresh_dof_state_tensor(self._sim)
 
+    def _set_dof_state_all_envs(self, dof_state: torch.Tensor):
+        """
+        Sets the same dof state in all envs, either a single interleaved row or (num_dofs, 2) pos, vel pairs on the device.
+        """
+        self._dof_state_buffer.copy_(dof_state.reshape(1, -1).expand_as(self._dof_state_buffer))
+        self.set_actor_dof_state(self._dof_state_buffer)
+
+    def _cache_robot_dofs(self):
+        """
+        Look up the dofs of every robot once, so apply_robot_cmd and reset_robot_state don't query the gym per call.
+        The lists are indexed by robot index.
+        """
+        self._robots = [a for a in self.env_cfg if a.type == "robot"]
+        self._robot_dof_counts = []
+        self._robot_left_wheel_ids = []
+        self._robot_right_wheel_ids = []
+        self._robot_other_ids = []
+        self._robot_is_diff = []
+        self._robot_r = []
+        self._robot_L = []
+        for robot in self._robots:
+            dof_dict = self._gym.get_actor_dof_dict(self.envs[0], robot.handle)
+            left, right, other = [], [], []
+            for name, i in dof_dict.items():
+                if robot.differential_drive and name in robot.left_wheel_joints:
+                    left.append(i)
+                elif robot.differential_drive and name in robot.right_wheel_joints:
+                    right.append(i)
+                else:
+                    other.append(i)
+
+            self._robot_dof_counts.append(self._gym.get_actor_dof_count(self.envs[0], robot.handle))
+            self._robot_left_wheel_ids.append(torch.tensor(left, dtype=torch.long, device=self.device))
+            self._robot_right_wheel_ids.append(torch.tensor(right, dtype=torch.long, device=self.device))
+            self._robot_other_ids.append(torch.tensor(other, dtype=torch.long, device=self.device))
+            self._robot_is_diff.append(bool(robot.differential_drive))
+            self._robot_r.append(robot.wheel_radius)
+            self._robot_L.append(robot.wheel_base)
+
+        # All differential drive robots batched, the wheel ids are flattened over the robots and *_cols maps each wheel
+        # id to its robot's column in the batch
+        diff = [k for k, is_diff in enumerate(self._robot_is_diff) if is_diff]
+        self._diff_r = torch.tensor([self._robot_r[k] for k in diff], dtype=torch.float32, device=self.device)
+        self._diff_L = torch.tensor([self._robot_L[k] for k in diff], dtype=torch.float32, device=self.device)
+        self._diff_left_ids, self._diff_left_cols = self._flatten_wheel_ids(self._robot_left_wheel_ids, diff)
+        self._diff_right_ids, self._diff_right_cols = self._flatten_wheel_ids(self._robot_right_wheel_ids, diff)
+
+        # Persistent command buffer for apply_robot_cmd, only the dofs no robot command writes have to be zeroed
+        self._u_buffer = torch.zeros(self._dof_state_3d.shape[:2], device=self.device)
+        written = torch.zeros(self._u_buffer.size(1), dtype=torch.bool)
+        for ids in self._robot_left_wheel_ids + self._robot_right_wheel_ids + self._robot_other_ids:
+            written[ids.cpu()] = True
+        self._u_unwritten_ids = torch.nonzero(~written).flatten().to(self.device)
+
+        # Note: the last robot decides, all robots are expected to use the same dof_mode
+        self._robot_dof_mode = self._robots[-1].dof_mode if self._robots else None
+
+        self._apply_robot_cmd_fast = self._make_apply_robot_cmd_fast()
+
+    def _make_apply_robot_cmd_fast(self):
+        """
+        Specialized apply_robot_cmd for a single robot without differential drive whose dofs are commanded in order, so
+        u_desired already is the full dof command. Returns None when that doesn't apply to the actors in the sim.
+        """
+        if len(self._robots) != 1 or self._robot_is_diff[0] or self._robots[0].name == "panda_gripper":
+            return None
+        dof_count = self._robot_dof_counts[0]
+        if dof_count != self._dof_state.size(1) // 2 or self._robot_other_ids[0].tolist() != list(range(dof_count)):
+            return None
+        setter = {
+            "effort": self.set_dof_actuation_force_tensor,
+            "velocity": self.set_dof_velocity_target_tensor,
+            "position": self.set_actor_dof_state,
+        }.get(self._robot_dof_mode)
+        if setter is None:
+            return None
+
+        shape = (self.num_envs, dof_count)
+
+        def apply_robot_cmd_fast(u_desired) -> bool:
+            # anything that would need broadcasting, casting or extra columns dropped takes the generic path
+            if u_desired.shape != shape or u_desired.dtype != torch.float32 or not u_desired.is_contiguous():
+                return False
+            setter(u_desired)
+            return True
+
+        return apply_robot_cmd_fast
+
+    def _flatten_wheel_ids(self, wheel_ids, diff):
+        ids = [wheel_ids[k] for k in diff]
+        cols = [torch.full_like(wheel_ids[k], col) for col, k in enumerate(diff)]
+        if not ids:
+            empty = torch.empty(0, dtype=torch.long, device=self.device)
+            return empty, empty
+        return torch.cat(ids), torch.cat(cols)
+
     def reset_to_initial_poses(self):
-        for actor in self.env_cfg:
-            actor_state = torch.tensor(
-                [*actor.init_pos, *actor.init_ori, *[0] * 6], device=self.device
-            )
-            self._root_state[:, actor.handle] = actor_state
+        self._root_state.copy_(self._initial_root_state.expand_as(self._root_state))
 
-        self._gym.set_actor_root_state_tensor(
-            self._sim, gymtorch.unwrap_tensor(self._root_state)
-        )
+        self._set_actor_root_state_tensor(self._root_state)
 
         # set initial joint poses
-        robots = [a for a in self.env_cfg if a.type == "robot"]
-        for robot in robots:
-            dof_state = []
-            if robot.init_joint_pose:
-                dof_state += robot.init_joint_pose
-                print(dof_state)
-            else:
-                dof_state += (
-                    [0] * 2 * self._gym.get_actor_dof_count(self.envs[0], robot.handle)
-                )
-        dof_state = (
-            torch.tensor(dof_state, device=self.device)
-            .type(torch.float32)
-            .repeat(self.num_envs, 1)
-        )
-        self._gym.set_dof_state_tensor(self._sim, gymtorch.unwrap_tensor(dof_state))
+        self._set_dof_state_all_envs(self._initial_dof_state)
         self._gym.refresh_dof_state_tensor(self._sim)
 
     @property
     def num_robots(self):
-        return len(self._robot_indices)
+        return len(self._robot_actor_indices)
+
+    def _select_actors(self, actor_slice, indices):
+        if actor_slice is not None:
+            return self._root_state[:, actor_slice]
+        return torch.index_select(self._root_state, 1, indices)
 
     @property
     def robot_positions(self):
-        return torch.index_select(self._root_state, 1, self._robot_indices)[:, :, 0:3]
+        """
+        Positions of the robots, (num_envs, num_robots, 3). A live view on the root state tensor when the robots are a
+        contiguous range of actors, so it changes with the next refresh, clone it to keep or modify it.
+        """
+        return self._select_actors(self._robot_slice, self.robot_indices)[:, :, 0:3]
 
     @property
     def robot_velocities(self):
-        return torch.index_select(self._root_state, 1, self._robot_indices)[:, :, 7:10]
+        """
+        Linear velocities of the robots, same view semantics as robot_positions.
+        """
+        return self._select_actors(self._robot_slice, self.robot_indices)[:, :, 7:10]
 
     @property
     def obstacle_positions(self):
-        return torch.index_select(self._root_state, 1, self._obstacle_indices)[
+        """
+        Positions of the obstacles, (num_envs, num_obstacles, 3), same view semantics as robot_positions.
+        """
+        return self._select_actors(self._obstacle_slice, self.obstacle_indices)[
             :, :, 0:3
         ]
 
     @property
     def ostacle_velocities(self):
-        return torch.index_select(self._root_state, 1, self._obstacle_indices)[
+        """
+        Linear velocities of the obstacles, same view semantics as robot_positions.
+        """
+        return self._select_actors(self._obstacle_slice, self.obstacle_indices)[
             :, :, 7:10
         ]
 
-    def _get_actor_index_by_name(self, name: str):
-        return torch.tensor([a.name for a in self.env_cfg].index(name), device=self.device)
+    def _get_actor_index_by_name(self, name: str) -> int:
+        return self._name_to_idx[name]
 
-    def _get_actor_index_by_robot_index(self, robot_idx: int):
-        return self._robot_indices[robot_idx]
+    def _get_actor_index_by_robot_index(self, robot_idx: int) -> int:
+        return self._robot_actor_indices[robot_idx]
 
-    # Getters
+    # Getters, these return live views on the state tensors instead of copies. They change with the next refresh in
+    # step() and writing to them writes to the simulator state, clone the result to keep or modify it.
     def get_actor_position_by_actor_index(self, actor_idx: int):
-        return torch.index_select(self._root_state, 1, actor_idx)[:, 0, 0:3]
+        """
+        Position of the actor in every env, (num_envs, 3), a live view on the root state tensor.
+        """
+        return self._root_state[:, actor_idx, 0:3]
 
     def get_actor_position_by_name(self, name: str):
+        """
+        Same as get_actor_position_by_actor_index, a view as well.
+        """
         actor_idx = self._get_actor_index_by_name(name)
         return self.get_actor_position_by_actor_index(actor_idx)
 
     def get_actor_position_by_robot_index(self, robot_idx: int):
+        """
+        Same as get_actor_position_by_actor_index, a view as well.
+        """
         actor_idx = self._get_actor_index_by_robot_index(robot_idx)
         return self.get_actor_position_by_actor_index(actor_idx)
 
     def get_actor_velocity_by_actor_index(self, idx: int):
-        return torch.index_select(self._root_state, 1, idx)[:, 0, 7:10]
+        """
+        Linear velocity of the actor in every env, (num_envs, 3), a live view on the root state tensor.
+        """
+        return self._root_state[:, idx, 7:10]
 
     def get_actor_velocity_by_name(self, name: str):
+        """
+        Same as get_actor_velocity_by_actor_index, a view as well.
+        """
         actor_idx = self._get_actor_index_by_name(name)
         return self.get_actor_velocity_by_actor_index(actor_idx)
 
     def get_actor_velocity_by_robot_index(self, robot_idx: int):
+        """
+        Same as get_actor_velocity_by_actor_index, a view as well.
+        """
         actor_idx = self._get_actor_index_by_robot_index(robot_idx)
         return self.get_actor_velocity_by_actor_index(actor_idx)
 
     def get_actor_orientation_by_actor_index(self, idx: int):
-        return torch.index_select(self._root_state, 1, idx)[:, 0, 3:7]
+        """
+        Orientation quaternion of the actor in every env, (num_envs, 4), a live view on the root state tensor.
+        """
+        return self._root_state[:, idx, 3:7]
 
     def get_actor_orientation_by_name(self, name: str):
+        """
+        Same as get_actor_orientation_by_actor_index, a view as well.
+        """
         actor_idx = self._get_actor_index_by_name(name)
         return self.get_actor_orientation_by_actor_index(actor_idx)
 
     def get_actor_orientation_by_robot_index(self, robot_idx: int):
+        """
+        Same as get_actor_orientation_by_actor_index, a view as well.
+        """
         actor_idx = self._get_actor_index_by_robot_index(robot_idx)
         return self.get_actor_orientation_by_actor_index(actor_idx)
 
+    def request_rigid_body_states(self):
+        """
+        Keep the rigid body state tensor refreshed in step(). The getters reading it call this themselves, the first
+        request refreshes right away so the first read isn't stale.
+        """
+        if not self._needs_rigid_body_refresh:
+            self._needs_rigid_body_refresh = True
+            self._gym.refresh_rigid_body_state_tensor(self._sim)
+
+    def request_contact_forces(self):
+        """
+        Same as request_rigid_body_states, for the net contact force tensor.
+        """
+        if not self._needs_contact_force_refresh:
+            self._needs_contact_force_refresh = True
+            self._gym.refresh_net_contact_force_tensor(self._sim)
+
     def get_rigid_body_by_rigid_body_index(self, rigid_body_idx: int):
-        return torch.index_select(self._rigid_body_state, 1, rigid_body_idx)[:, 0, :]
+        """
+        State of the rigid body in every env, (num_envs, 13), a live view on the rigid body state tensor.
+        """
+        self.request_rigid_body_states()
+        return self._rigid_body_state[:, rigid_body_idx, :]
 
     def get_actor_link_by_name(self, actor_name: str, link_name: str):
-        actor_idx = self._get_actor_index_by_name(actor_name)
-        rigid_body_idx = torch.tensor(
-            self._gym.find_actor_rigid_body_index(
-                self.envs[0], actor_idx, link_name, gymapi.IndexDomain.DOMAIN_ENV
-            ),
-            device=self.device,
-        )
+        """
+        Same as get_rigid_body_by_rigid_body_index, a view as well.
+        """
+        rigid_body_idx = self._link_rigid_body_index[(actor_name, link_name)]
         return self.get_rigid_body_by_rigid_body_index(rigid_body_idx)
 
     def get_actor_contact_forces_by_name(self, actor_name: str, link_name: str):
-        actor_idx = self._get_actor_index_by_name(actor_name)
-        rigid_body_idx = torch.tensor(
-            self._gym.find_actor_rigid_body_index(
-                self.envs[0], actor_idx, link_name, gymapi.IndexDomain.DOMAIN_ENV
-            ),
-            device=self.device,
-        )
+        """
+        Net contact force on the link in every env, (num_envs, 3), a live view on the net contact force tensor.
+        """
+        self.request_contact_forces()
+        rigid_body_idx = self._link_rigid_body_index[(actor_name, link_name)]
         return self._net_contact_force[:, rigid_body_idx]
 
     # torch.index_select(self._net_contact_force, 1, rigid_body_idx)
@@ -360,39 +563,63 @@ class IsaacGymWrapper:
     def set_actor_position_by_actor_index(
         self, position: List[float], actor_idx: int
     ) -> None:
-        self._root_state[:, actor_idx, :3] = position
-        self._gym.set_actor_root_state_tensor_indexed(
-            self._sim, gymtorch.unwrap_tensor(self._root_state), gymtorch.unwrap_tensor(torch.tensor([actor_idx], dtype=torch.int32, device=self.device)), 1
-        )
+        self._queue_actor_position(position, actor_idx)
 
     def set_actor_position_by_name(self, position: List[float], name: str) -> None:
-        actor_idx = [a.name for a in self.env_cfg].index(name)
+        actor_idx = self._get_actor_index_by_name(name)
         self.set_actor_position_by_actor_index(position, actor_idx)
 
     def set_actor_position_by_robot_index(
         self, position: List[float], robot_idx: str
     ) -> None:
-        actor_idx = self._robot_indices[robot_idx]
+        actor_idx = self._get_actor_index_by_robot_index(robot_idx)
         self.set_actor_position_by_actor_index(position, actor_idx)
 
     def set_actor_velocity_by_actor_index(
         self, velocity: List[float], actor_idx: int
     ) -> None:
-        self._root_state[:, actor_idx, 7:10] = velocity
-        self._gym.set_actor_root_state_tensor_indexed(
-            self._sim, gymtorch.unwrap_tensor(self._root_state), gymtorch.unwrap_tensor(torch.tensor([actor_idx], dtype=torch.int32, device=self.device)), 1
-        )
+        self._queue_actor_velocity(velocity, actor_idx)
 
     def set_actor_velocity_by_name(self, velocity: List[float], name: str) -> None:
-        actor_idx = [a.name for a in self.env_cfg].index(name)
+        actor_idx = self._get_actor_index_by_name(name)
         self.set_actor_velocity_by_actor_index(torch.tensor(velocity), actor_idx)
 
     def set_actor_velocity_by_robot_index(
         self, velocity: List[float], robot_idx: str
     ) -> None:
-        actor_idx = self._robot_indices[robot_idx]
+        actor_idx = self._get_actor_index_by_robot_index(robot_idx)
         self.set_actor_velocity_by_actor_index(velocity, actor_idx)
 
+    # The single actor setters only write the root state tensor here and queue the actor, the writes reach the sim in
+    # one indexed call when flush_root_state_writes is called, at the latest at the start of the next step()
+    def _queue_actor_position(self, position: List[float], actor_idx: int) -> None:
+        self._root_state[:, actor_idx, :3] = position
+        self._queue_root_write(actor_idx)
+
+    def _queue_actor_velocity(self, velocity: List[float], actor_idx: int) -> None:
+        self._root_state[:, actor_idx, 7:10] = velocity
+        self._queue_root_write(actor_idx)
+
+    def _queue_root_write(self, actor_idx: int) -> None:
+        if actor_idx not in self._pending_root_writes:
+            self._pending_root_writes.append(actor_idx)
+
+    def flush_root_state_writes(self) -> None:
+        if not self._pending_root_writes:
+            return
+        n = len(self._pending_root_writes)
+        idx_t = self._pending_indices_tensor[:n]
+        idx_t.copy_(torch.as_tensor(self._pending_root_writes, dtype=torch.int32), non_blocking=True)
+        self._gym.set_actor_root_state_tensor_indexed(
+            self._sim, gymtorch.unwrap_tensor(self._root_state), gymtorch.unwrap_tensor(idx_t), n
+        )
+        self._pending_root_writes.clear()
+
+    def _set_actor_root_state_tensor(self, state: torch.Tensor) -> None:
+        # a full write supersedes the queued single actor writes
+        self._pending_root_writes.clear()
+        self._gym.set_actor_root_state_tensor(self._sim, gymtorch.unwrap_tensor(state))
+
     def set_actor_dof_state(self, state):
         self._gym.set_dof_state_tensor(self._sim, gymtorch.unwrap_tensor(state))
 
@@ -423,7 +650,17 @@ class IsaacGymWrapper:
         self.stop_sim()
         self.start_sim()
 
-    def _create_actor(self, env, env_idx, asset, actor: ActorWrapper) -> int:
+    def _draw_actor_noise(self, actor: ActorWrapper, asset) -> dict:
+        num_shapes = self._gym.get_asset_rigid_shape_count(asset)
+        mass_range = actor.noise_percentage_mass * actor.mass
+        friction_range = actor.noise_percentage_friction * actor.friction
+        return {
+            "mass": np.random.uniform(-mass_range, mass_range, size=self.num_envs),
+            "friction": np.random.uniform(-friction_range, friction_range, size=(self.num_envs, num_shapes)),
+            "torsion_friction": np.random.uniform(0.001, 0.01, size=(self.num_envs, num_shapes)),
+        }
+
+    def _create_actor(self, env, env_idx, asset, actor: ActorWrapper, noise: dict) -> int:
         if actor.noise_sigma_size is not None:
             asset = load_asset(self._gym, self._sim, actor)
 
@@ -445,11 +682,7 @@ class IsaacGymWrapper:
             env, handle, 0, gymapi.MESH_VISUAL_AND_COLLISION, gymapi.Vec3(*actor.color)
         )
         props = self._gym.get_actor_rigid_body_properties(env, handle)
-        actor_mass_noise = np.random.uniform(
-            -actor.noise_percentage_mass * actor.mass,
-            actor.noise_percentage_mass * actor.mass,
-        )
-        props[0].mass = actor.mass + actor_mass_noise
+        props[0].mass = actor.mass + noise["mass"][env_idx]
         self._gym.set_actor_rigid_body_properties(env, handle, props)
 
         body_names = self._gym.get_actor_rigid_body_names(env, handle)
@@ -462,13 +695,12 @@ class IsaacGymWrapper:
         ]
 
         props = self._gym.get_actor_rigid_shape_properties(env, handle)
+        friction_noise = noise["friction"][env_idx]
+        torsion_friction = noise["torsion_friction"][env_idx]
         for i, p in enumerate(props):
-            actor_friction_noise = np.random.uniform(
-                -actor.noise_percentage_friction * actor.friction,
-                actor.noise_percentage_friction * actor.friction,
-            )
+            actor_friction_noise = friction_noise[i]
             p.friction = actor.friction + actor_friction_noise
-            p.torsion_friction = np.random.uniform(0.001, 0.01)
+            p.torsion_friction = torsion_friction[i]
             p.rolling_friction = actor.friction + actor_friction_noise
 
             if i in caster_shapes:
@@ -504,14 +736,17 @@ class IsaacGymWrapper:
             self._gym.set_actor_dof_properties(env, handle, props)
         return handle
 
-    def _ik(self, actor, u):
-        r = actor.wheel_radius
-        L = actor.wheel_base
+    def _ik(self, u):
+        """
+        Wheel velocities of all differential drive robots from (vel, yaw_rate), of shape (num_envs, num_diff_robots).
+        """
+        r = self._diff_r
+        L = self._diff_L
         # wheel_sets = actor.wheel_count // 2
 
         # Diff drive fk
-        u_left_wheel = (u[:, 0] / r) - ((L * u[:, 1]) / (2 * r))
-        u_right_wheel = (u[:, 0] / r) + ((L * u[:, 1]) / (2 * r))
+        u_left_wheel = (u[:, 0:1] / r) - ((L * u[:, 1:2]) / (2 * r))
+        u_right_wheel = (u[:, 0:1] / r) + ((L * u[:, 1:2]) / (2 * r))
 
         # if wheel_sets > 1:
         #     u_ik = u_ik.repeat(1, wheel_sets)
@@ -521,39 +756,33 @@ class IsaacGymWrapper:
     def apply_robot_cmd(self, u_desired):
         if len(u_desired.size()) == 1:
             u_desired = u_desired.unsqueeze(0)
+        # Single (asynchronous when u_desired is pinned) transfer instead of one per dof assignment below
+        u_desired = u_desired.to(self.device, non_blocking=True)
 
-        dof_shape = list(self._dof_state.size())
-        dof_shape[1] = dof_shape[1] // 2
-        u = torch.zeros(dof_shape, device=self.device)
+        if self._apply_robot_cmd_fast is not None and self._apply_robot_cmd_fast(u_desired):
+            return
 
-        u_desired_idx = 0
-        dof_mode = None
-        for actor in self.env_cfg:
-            if actor.type != "robot":
-                continue
-            dof_mode = actor.dof_mode
+        u = self._u_buffer
+        if len(self._u_unwritten_ids) > 0:
+            u[:, self._u_unwritten_ids] = 0.0
 
-            if dof_mode is not None and dof_mode != actor.dof_mode:
-                raise ValueError("All robots must have the same dof_mode")
+        # use first two u_desired values for differential drive (vel, yaw_rate)
+        if len(self._diff_r) > 0:
+            u_left_desired, u_right_desired = self._ik(u_desired[:, :2])
+            u[:, self._diff_left_ids] = u_left_desired[:, self._diff_left_cols]
+            u[:, self._diff_right_ids] = u_right_desired[:, self._diff_right_cols]
 
-            actor_dof_count = self._gym.get_actor_dof_count(self.envs[0], actor.handle)
-            dof_dict = self._gym.get_actor_dof_dict(self.envs[0], actor.handle)
+        u_desired_idx = 0
+        for k, actor in enumerate(self._robots):
+            actor_dof_count = self._robot_dof_counts[k]
 
-            # use first two u_desired values for differential drive (vel, yaw_rate)
-            if actor.differential_drive:
-                u_left_desired, u_right_desired = self._ik(
-                    actor, u_desired[:, :2]
-                )
+            if self._robot_is_diff[k]:
                 u_desired_idx += 2
 
-            for name, i in dof_dict.items():
-                if actor.differential_drive and name in actor.left_wheel_joints:
-                    u[:, i] = u_left_desired
-                elif actor.differential_drive and name in actor.right_wheel_joints:
-                    u[:, i] = u_right_desired
-                else:
-                    u[:, i] = u_desired[:, u_desired_idx]
-                    u_desired_idx += 1
+            # the remaining dofs take the next u_desired values in dof order
+            other_ids = self._robot_other_ids[k]
+            u[:, other_ids] = u_desired[:, u_desired_idx : u_desired_idx + len(other_ids)]
+            u_desired_idx += len(other_ids)
 
             if actor.name == 'panda_gripper':
                 u[u[:, actor_dof_count -1] > 0.0, actor_dof_count-1] = 0.1
@@ -561,6 +790,7 @@ class IsaacGymWrapper:
                 u[u[:, actor_dof_count -1] > 0.0, actor_dof_count-2] = 0.1
                 u[u[:, actor_dof_count -1] >= 0.0, actor_dof_count-2] = -0.1
 
+        dof_mode = self._robot_dof_mode
         if dof_mode == "effort":
             self.set_dof_actuation_force_tensor(u)
         elif dof_mode == "velocity":
@@ -575,12 +805,9 @@ class IsaacGymWrapper:
 
         q_idx = 0
 
-        dof_state = []
-        for actor in self.env_cfg:
-            if actor.type != "robot":
-                continue
-
-            actor_dof_count = self._gym.get_actor_dof_count(self.envs[0], actor.handle)
+        dof_q = []
+        dof_qdot = []
+        for actor, actor_dof_count in zip(self._robots, self._robot_dof_counts):
 
             if actor.differential_drive:
                 actor_q_count = actor_dof_count - (actor.wheel_count - 3)
@@ -600,24 +827,29 @@ class IsaacGymWrapper:
                 actor_q = list(actor_q[3:]) + [0] * actor.wheel_count
                 actor_qdot = list(actor_qdot[3:]) + [0] * actor.wheel_count
 
-            for _q, _qdot in zip(actor_q, actor_qdot):
-                dof_state.append(_q)
-                dof_state.append(_qdot)
+            n = min(len(actor_q), len(actor_qdot))
+            dof_q.extend(actor_q[:n])
+            dof_qdot.extend(actor_qdot[:n])
 
             q_idx += actor_q_count
 
-        dof_state_tensor = torch.tensor(dof_state).type(torch.float32).to(self.device)
-
-        dof_state_tensor = dof_state_tensor.repeat(self.num_envs, 1)
-        self.set_actor_dof_state(dof_state_tensor)
+        # (num_dofs, 2) pos, vel pairs, uploaded once and asynchronously from the pinned staging buffer
+        if self._dof_reset_event is not None:
+            self._dof_reset_event.synchronize()
+        staging = self._dof_reset_staging.numpy()
+        staging[: len(dof_q), 0] = dof_q
+        staging[: len(dof_qdot), 1] = dof_qdot
+        dof_state = self._dof_reset_staging[: len(dof_q)].to(self.device, non_blocking=True)
+        if self._dof_reset_event is not None:
+            self._dof_reset_event.record()
+        self._set_dof_state_all_envs(dof_state)
 
-        self._gym.set_actor_root_state_tensor(
-            self._sim, gymtorch.unwrap_tensor(self._root_state)
-        )
+        self._set_actor_root_state_tensor(self._root_state)
 
     def interactive_goal_update(self):
         for e in self._gym.query_viewer_action_events(self.viewer):
-            goal_pos = self.get_actor_position_by_name("goal")
+            # a copy, the getter's view would write the new position into the root state before it's queued
+            goal_pos = self.get_actor_position_by_name("goal").clone()
             delta_pos = 0.1
             if e.action == "up":
                 goal_pos[0, 1] -= delta_pos
@@ -634,27 +866,50 @@ class IsaacGymWrapper:
             self.set_actor_position_by_name(position=goal_pos, name="goal")
 
     def step(self):
+        self.flush_root_state_writes()
         self._gym.simulate(self._sim)
         self._gym.fetch_results(self._sim, True)
         self._gym.refresh_actor_root_state_tensor(self._sim)
         self._gym.refresh_dof_state_tensor(self._sim)
-        self._gym.refresh_rigid_body_state_tensor(self._sim)
-        self._gym.refresh_net_contact_force_tensor(self._sim)
+        if self._needs_rigid_body_refresh:
+            self._gym.refresh_rigid_body_state_tensor(self._sim)
+        if self._needs_contact_force_refresh:
+            self._gym.refresh_net_contact_force_tensor(self._sim)
 
         if self.viewer is not None:
             self._gym.step_graphics(self._sim)
             self._gym.draw_viewer(self.viewer, self._sim, False)
 
         if self._visualize_link_present:
-            self.visualize_link_buffer.append(self.visualize_link_pos.clone())
+            if self._viz_step == len(self._visualize_link_buffer):
+                self._grow_visualize_link_buffer()
+            self._visualize_link_buffer[self._viz_step].copy_(self.visualize_link_pos, non_blocking=True)
+            self._viz_step += 1
 
         if self.interactive_goal:
             self.interactive_goal_update()
 
+    @property
+    def visualize_link_buffer(self) -> torch.Tensor:
+        """
+        Visualize link positions of the steps since the last reset, of shape (steps, num_envs, 3).
+        """
+        return self._visualize_link_buffer[: self._viz_step]
+
+    def reset_visualize_link_buffer(self):
+        self._viz_step = 0
+
+    def _grow_visualize_link_buffer(self):
+        buffer = torch.empty(
+            (max(2 * len(self._visualize_link_buffer), 8),) + self._visualize_link_buffer.shape[1:],
+            device=self.device,
+        )
+        buffer[: self._viz_step].copy_(self.visualize_link_buffer)
+        self._visualize_link_buffer = buffer
 
     def set_root_state_tensor_by_actor_idx(self, state_tensor, idx):
-        for i in range(self.num_envs):
-            self._root_state[i, idx] = state_tensor
+        # broadcasts over the envs, a (num_envs, 13) state_tensor sets each env separately
+        self._root_state[:, idx] = state_tensor
 
     def save_root_state(self):
         self.saved_root_state = self._root_state.clone()
@@ -664,30 +919,22 @@ class IsaacGymWrapper:
 
     def reset_root_state(self):
         if self._visualize_link_present:
-            self.visualize_link_buffer = []
+            self.reset_visualize_link_buffer()
 
         if self.saved_root_state is not None:
-            self._gym.set_actor_root_state_tensor(
-                self._sim, gymtorch.unwrap_tensor(self.saved_root_state)
-            )
+            self._set_actor_root_state_tensor(self.saved_root_state)
 
     def set_state_tensor_by_pos_vel(self, handle, pos, vel):
-        roll = 0
-        pitch = 0
-        yaw = pos[2]
-        orientation = [
-            np.sin(roll / 2) * np.cos(pitch / 2) * np.cos(yaw / 2)
-            - np.cos(roll / 2) * np.sin(pitch / 2) * np.sin(yaw / 2),
-            np.cos(roll / 2) * np.sin(pitch / 2) * np.cos(yaw / 2)
-            + np.sin(roll / 2) * np.cos(pitch / 2) * np.sin(yaw / 2),
-            np.cos(roll / 2) * np.cos(pitch / 2) * np.sin(yaw / 2)
-            - np.sin(roll / 2) * np.sin(pitch / 2) * np.cos(yaw / 2),
-            np.cos(roll / 2) * np.cos(pitch / 2) * np.cos(yaw / 2),
-        ]
+        # roll and pitch are zero, so the quaternion only depends on the yaw
+        half_yaw = float(pos[2]) / 2
+        state = torch.tensor(
+            [pos[0], pos[1], 0, 0, 0, math.sin(half_yaw), math.cos(half_yaw), *vel[:3]],
+            dtype=torch.float32,
+            device=self.device,
+        )
 
-        self.root_state[:, handle, :2] = torch.tensor(pos[:2], device=self.device)
-        self.root_state[:, handle, 3:7] = torch.tensor(orientation, device=self.device)
-        self.root_state[:, handle, 7:10] = torch.tensor(vel, device=self.device)
+        self._root_state[:, handle, :2] = state[:2]
+        self._root_state[:, handle, 3:10] = state[3:]
 
     def update_root_state_tensor_by_obstacles(self, obstacles):
         """
@@ -695,6 +942,8 @@ class IsaacGymWrapper:
         where each obstacle is a list of the following order [position, velocity, type, size]
         """
         env_cfg_changed = False
+        obst_indices = []
+        obst_states = []
 
         for i, obst in enumerate(list(obstacles.values())):
             pos = obst["position"]
@@ -702,11 +951,8 @@ class IsaacGymWrapper:
             o_type = "sphere"
             o_size = obst["size"]
             name = f"{o_type}{i}"
-            try:
-                obst_idx = [
-                    idx for idx, actor in enumerate(self.env_cfg) if actor.name == name
-                ][0]
-            except:
+            obst_idx = self._name_to_idx.get(name)
+            if obst_idx is None:
                 self.env_cfg.append(
                     ActorWrapper(
                         **{
@@ -721,51 +967,76 @@ class IsaacGymWrapper:
                 env_cfg_changed = True
                 continue
 
-            obst_state = torch.tensor(
-                [*pos, 0, 0, 0, 1, *vel, 0, 0, 0], device=self.device
-            )
+            obst_indices.append(obst_idx)
+            obst_states.append([*pos, 0, 0, 0, 1, *vel, 0, 0, 0])
 
             # Note: reset simulator if size changed, because this cannot be done at runtime.
             if not all([a == b for a, b in zip(o_size, self.env_cfg[obst_idx].size)]):
                 env_cfg_changed = True
                 self.env_cfg[obst_idx].size = o_size
 
-            for j, env in enumerate(self.envs):
-                self._root_state[j, obst_idx] = obst_state
+        # single upload and one write covering all obstacles in all envs
+        if obst_indices:
+            self._root_state[:, obst_indices] = torch.tensor(
+                obst_states, dtype=torch.float32
+            ).to(self.device)
 
         # restart _sim for env changes
         if env_cfg_changed:
             self.stop_sim()
             self.start_sim()
 
-        self._gym.set_actor_root_state_tensor(
-            self._sim, gymtorch.unwrap_tensor(self._root_state)
-        )
+        self._set_actor_root_state_tensor(self._root_state)
 
     def update_root_state_tensor_by_obstacles_tensor(self, obst_tensor):
-        for o_tensor in obst_tensor:
-            obst_idx = [
-                idx for idx, actor in enumerate(self.env_cfg) if (actor.type != 'robot' and not actor.fixed)
-            ][0]
-
-            self.root_state[:, obst_idx] = o_tensor.repeat(self.num_envs, 1)
+        for o_tensor, obst_idx in zip(obst_tensor, self._movable_obstacle_indices):
+            self._root_state[:, obst_idx] = o_tensor
 
-        self._gym.set_actor_root_state_tensor(
-            self._sim, gymtorch.unwrap_tensor(self._root_state)
-        )
+        self._set_actor_root_state_tensor(self._root_state)
 
-    def draw_lines(self, lines, env_idx=0):
-        # convert list of vertices into line segments
-        line_segments = (
-            torch.concat((lines[:-1], lines[1:]), axis=-1)
-            .flatten(end_dim=-2)
-            .cpu()
-            .numpy()
-            .astype(np.float32)
-        )
-        num_lines = line_segments.shape[0]
-        colors = np.zeros((num_lines, 3), dtype=np.float32)
-        colors[:, 1] = 255
+    def _stage_lines(self, lines: torch.Tensor) -> torch.Tensor:
+        """
+        Copy device lines to the host through a pinned float32 staging buffer, which avoids a pageable allocation per
+        frame and converts the dtype on the device.
+        """
+        if not lines.is_cuda:
+            return lines
+        needed = lines.numel()
+        if self._line_staging is None or self._line_staging.numel() < needed:
+            self._line_staging = torch.empty((needed,), dtype=torch.float32, pin_memory=True)
+        staging = self._line_staging[:needed].view(lines.shape)
+        staging.copy_(lines, non_blocking=True)
+        torch.cuda.current_stream(lines.device).synchronize()
+        return staging
+
+    def draw_lines(self, lines, env_idx=0, clear=False):
+        """
+        With clear the previous lines are removed right before the new ones are added, after the new segments are
+        prepared, so the viewer is never left without lines and both viewer updates happen back to back.
+        """
+        # convert list of vertices into line segments, written straight into preallocated [start, end] rows
+        # Note: fewer than two steps, e.g. no rollouts yet, give no segments, and lines[0] may not exist
+        num_lines = 0 if lines.size(0) < 2 else (lines.size(0) - 1) * (lines[0].numel() // 3)
+        if num_lines == 0:
+            if clear:
+                self._gym.clear_lines(self.viewer)
+            return
+
+        if self._line_vertices is None or self._line_vertices.shape[0] < num_lines:
+            self._line_vertices = np.empty((num_lines, 6), dtype=np.float32)
+            self._line_colors = np.zeros((num_lines, 3), dtype=np.float32)
+            self._line_colors[:, 1] = 255
+
+        lines = self._stage_lines(lines)
+        line_segments = self._line_vertices[:num_lines]
+        line_segments[:, 0:3] = lines[:-1].reshape(-1, 3).numpy()
+        line_segments[:, 3:6] = lines[1:].reshape(-1, 3).numpy()
+        if clear:
+            self._gym.clear_lines(self.viewer)
         self._gym.add_lines(
-            self.viewer, self.envs[env_idx], num_lines, line_segments, colors
+            self.viewer,
+            self.envs[env_idx],
+            num_lines,
+            line_segments,
+            self._line_colors[:num_lines],
         )
@@ -1,5 +1,5 @@
 from mppiisaac.planner.isaacgym_wrapper import IsaacGymWrapper, ActorWrapper
-from mppiisaac.utils.transport import bytes_to_torch, torch_to_bytes
+from mppiisaac.utils.transport import bytes_to_torch, torch_to_bytes, SharedTensor, SharedCudaTensor
 from mppi_torch.mppi import MPPIPlanner as MPPIPlanner
 import mppiisaac
 from typing import Callable, Optional
@@ -49,6 +49,12 @@ class MPPIisaacPlanner(object):
 
         # Note: place_holder variable to pass to mppi so it doesn't complain, while the real state is actually the isaacgym simulator itself.
         self.state_place_holder = torch.zeros((self.cfg.mppi.num_samples, self.cfg.nx))
+
+        # Shared memory buffers, only set once a world process calls open_shared_buffers
+        self._dof_state_shm = None
+        self._root_state_shm = None
+        self._action_shm = None
+        self._rollouts_shm = None
     
     def update_objective(self, objective):
         self.objective = objective
@@ -86,9 +92,15 @@ class MPPIisaacPlanner(object):
     def reset_rollout_sim(
         self, dof_state_tensor, root_state_tensor, rigid_body_state_tensor=None
     ):
-        self.sim.visualize_link_buffer = []
-        self.sim._dof_state[:] = bytes_to_torch(dof_state_tensor)
-        self.sim._root_state[:] = bytes_to_torch(root_state_tensor)
+        self._reset_rollout_sim(
+            bytes_to_torch(dof_state_tensor), bytes_to_torch(root_state_tensor)
+        )
+
+    def _reset_rollout_sim(self, dof_state, root_state):
+        if self.sim._visualize_link_present:
+            self.sim.reset_visualize_link_buffer()
+        self.sim._dof_state[:] = dof_state
+        self.sim._root_state[:] = root_state
 
         self.sim._gym.set_dof_state_tensor(
             self.sim._sim, gymtorch.unwrap_tensor(self.sim._dof_state)
@@ -111,6 +123,63 @@ class MPPIisaacPlanner(object):
     def command(self):
         return torch_to_bytes(self.mppi.command(self.state_place_holder))
 
+    def open_shared_buffers(self, dof_state_spec, root_state_spec):
+        """
+        Attach to the state buffers shared by the world and allocate the action and rollouts buffers it reads back.
+        Returns the specs of the latter so the world can attach to them.
+        """
+        self.close_shared_buffers()
+        self._dof_state_shm = SharedTensor.attach(dof_state_spec)
+        self._root_state_shm = SharedTensor.attach(root_state_spec)
+
+        nu = len(self.cfg.mppi.noise_sigma)
+        self._action_shm = SharedTensor.create((nu,))
+
+        # Keep the rollouts on the device and hand out a CUDA IPC handle, so they never pass through host memory here.
+        # They are only drawn, so half precision is plenty and halves the bytes the world copies per frame.
+        rollouts_shape = (self.cfg.mppi.horizon, self.cfg.mppi.num_samples, 3)
+        if self.sim.device.startswith("cuda"):
+            self._rollouts_shm = SharedCudaTensor.create(
+                rollouts_shape, dtype=torch.float16, device=self.sim.device
+            )
+        else:
+            self._rollouts_shm = SharedTensor.create(rollouts_shape, dtype=torch.float16)
+        return {"action": self._action_shm.spec(), "rollouts": self._rollouts_shm.spec()}
+
+    def close_shared_buffers(self):
+        for buf in (self._dof_state_shm, self._root_state_shm, self._action_shm, self._rollouts_shm):
+            if buf is not None:
+                buf.close()
+        self._dof_state_shm = None
+        self._root_state_shm = None
+        self._action_shm = None
+        self._rollouts_shm = None
+
+    def compute_action_shared(self):
+        """
+        Same as compute_action_tensor, but the states are read from and the action and rollouts are written to the shared memory buffers.
+        Returns the number of valid rollout steps in the rollouts buffer.
+        """
+        self.objective.reset()
+        self._reset_rollout_sim(self._dof_state_shm.tensor, self._root_state_shm.tensor)
+        action = self.mppi.command(self.state_place_holder)
+        n = self._write_rollouts_shared()
+        self._action_shm.tensor.copy_(action)
+        return n
+
+    def _write_rollouts_shared(self):
+        if not self.sim._visualize_link_present:
+            return 0
+
+        rollouts = self._rollouts_shm.tensor
+        n = min(len(self.sim.visualize_link_buffer), rollouts.size(0))
+        if n > 0:
+            rollouts[:n].copy_(self.sim.visualize_link_buffer[:n])
+            # The world reads the buffer as soon as we reply, so the copy has to be finished by then
+            if rollouts.is_cuda:
+                torch.cuda.current_stream(rollouts.device).synchronize()
+        return n
+
     def add_to_env(self, env_cfg_additions):
         self.sim.add_to_envs(env_cfg_additions)
 
@@ -120,7 +189,7 @@ class MPPIisaacPlanner(object):
         if not self.sim._visualize_link_present:
             return torch_to_bytes(torch.zeros((1, 1, 1)))
 
-        return torch_to_bytes(torch.stack(self.sim.visualize_link_buffer))
+        return torch_to_bytes(self.sim.visualize_link_buffer)
 
     def update_weights(self, weights):
         self.objective.weights = weights
@@ -1,7 +1,8 @@
+import dataclasses
 from dataclasses import dataclass, field
 from mppi_torch.mppi import MPPIConfig
 from mppiisaac.planner.isaacgym_wrapper import IsaacGymConfig, ActorWrapper
-from hydra.core.config_store import ConfigStore
+from hydra.core.config_store import ConfigNode, ConfigStore
 
 from typing import List, Optional
 
@@ -16,31 +17,289 @@ class ExampleConfig:
     nx: int
     actors: List[str]
     initial_actor_positions: List[List[float]]
+    # Plan in a background thread while the simulator steps, the applied action then lags the state by at least one step
+    async_planning: bool = False
 
 
+# All example configs share the ExampleConfig schema
+_NAMES = (
+    "config_point_robot",
+    "config_multi_point_robot",
+    "config_heijn_robot",
+    "config_boxer_robot",
+    "config_jackal_robot",
+    "config_multi_jackal",
+    "config_panda",
+    "config_omnipanda",
+    "config_panda_push",
+    "config_heijn_push",
+    "config_heijn_reach",
+    "config_boxer_push",
+    "config_boxer_reach",
+    "config_panda_c_space_goal",
+)
+_NAME_TO_NODE = dict.fromkeys(_NAMES, ExampleConfig)
+_GROUP_NODES = {("mppi", "base_mppi"): MPPIConfig, ("isaacgym", "base_isaacgym"): IsaacGymConfig}
+_REGISTERED = set()
+
 cs = ConfigStore.instance()
-cs.store(name="config_point_robot", node=ExampleConfig)
-cs.store(name="config_multi_point_robot", node=ExampleConfig)
-cs.store(name="config_heijn_robot", node=ExampleConfig)
-cs.store(name="config_boxer_robot", node=ExampleConfig)
-cs.store(name="config_jackal_robot", node=ExampleConfig)
-cs.store(name="config_multi_jackal", node=ExampleConfig)
-cs.store(name="config_panda", node=ExampleConfig)
-cs.store(name="config_omnipanda", node=ExampleConfig)
-cs.store(name="config_panda_push", node=ExampleConfig)
-cs.store(name="config_heijn_push", node=ExampleConfig)
-cs.store(name="config_heijn_reach", node=ExampleConfig)
-cs.store(name="config_boxer_push", node=ExampleConfig)
-cs.store(name="config_boxer_reach", node=ExampleConfig)
-cs.store(name="config_panda_c_space_goal", node=ExampleConfig)
-cs.store(group="mppi", name="base_mppi", node=MPPIConfig)
-cs.store(group="isaacgym", name="base_isaacgym", node=IsaacGymConfig)
-
-
-from hydra import compose, initialize
-from omegaconf import OmegaConf
-def load_isaacgym_config(name):
-    with initialize(config_path="../../conf"):
-        cfg = compose(config_name=name)
-        print(OmegaConf.to_yaml(cfg))
-    return cfg
\ No newline at end of file
+
+
+def _register_configs(names=None):
+    """
+    Store the schemas of the given config names, all by default, and the group schemas in hydra's ConfigStore. Names
+    that are already registered are skipped.
+    """
+    for group, name in _GROUP_NODES:
+        if (group, name) not in _REGISTERED:
+            cs.store(group=group, name=name, node=_GROUP_NODES[(group, name)])
+            _REGISTERED.add((group, name))
+    for name in _NAME_TO_NODE if names is None else names:
+        if name not in _REGISTERED and name in _NAME_TO_NODE:
+            _store_schema(name, _NAME_TO_NODE[name])
+            _REGISTERED.add(name)
+
+
+# first ConfigNode stored per schema, reused for the other names with the same schema
+_SCHEMA_NODES = {}
+
+
+def _store_schema(name, schema):
+    """
+    cs.store converts the dataclass to a structured config on every call. Names sharing a schema reuse the first
+    converted node instead, which is safe since ConfigStore.load hands out deep copies.
+    """
+    config_node = _SCHEMA_NODES.get(schema)
+    if config_node is None:
+        cs.store(name=name, node=schema)
+        config_node = cs.repo.get(f"{name}.yaml")
+        if isinstance(config_node, ConfigNode):
+            _SCHEMA_NODES[schema] = config_node
+        return
+    cs.repo[f"{name}.yaml"] = dataclasses.replace(config_node, name=f"{name}.yaml")
+
+
+# Note: the examples' @hydra.main entry points look the schemas up before any of our code runs, so importing this
+# module still registers all of them. load_isaacgym_config only makes sure its own name is registered.
+_register_configs()
+
+
+import hydra
+from hydra import compose, initialize_config_dir
+from hydra.types import RunMode
+from omegaconf import OmegaConf, open_dict
+import omegaconf._utils
+import copy
+import functools
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import yaml
+
+
+def _use_libyaml_loader():
+    """
+    Let OmegaConf, and with it hydra's config sources, parse yaml with the libyaml backed CSafeLoader. The loader keeps
+    OmegaConf's customizations: its float and timestamp resolvers and the duplicate key check.
+
+    Note: this patches omegaconf._utils.get_yaml_loader for the whole process, as soon as this module is imported. It
+    only affects code that looks get_yaml_loader up at call time, as OmegaConf.create/load and hydra's file config
+    source do, not modules that imported the function itself before the patch (e.g. omegaconf.basecontainer, which
+    keeps the pure python loader).
+    """
+    try:
+        from yaml import CSafeLoader
+    except ImportError:
+        # pyyaml built without libyaml, keep the pure python loader
+        return
+
+    base_loader = omegaconf._utils.get_yaml_loader()
+
+    class OmegaConfCLoader(CSafeLoader):
+        def construct_mapping(self, node, deep=False):
+            keys = set()
+            for key_node, _ in node.value:
+                if key_node.tag != yaml.resolver.BaseResolver.DEFAULT_SCALAR_TAG:
+                    continue
+                if key_node.value in keys:
+                    raise yaml.constructor.ConstructorError(
+                        "while constructing a mapping",
+                        node.start_mark,
+                        f"found duplicate key {key_node.value}",
+                        key_node.start_mark,
+                    )
+                keys.add(key_node.value)
+            return super().construct_mapping(node, deep=deep)
+
+    OmegaConfCLoader.yaml_implicit_resolvers = base_loader.yaml_implicit_resolvers
+    omegaconf._utils.get_yaml_loader = lambda: OmegaConfCLoader
+
+
+_use_libyaml_loader()
+
+
+logger = logging.getLogger(__name__)
+
+_CONF_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "conf"))
+_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "mppiisaac")
+
+
+def _describe_schema(schema) -> tuple:
+    """
+    Field names, types and defaults of a dataclass schema, including the dataclasses nested in it.
+    """
+    fields = []
+    for f in dataclasses.fields(schema):
+        if f.default is not dataclasses.MISSING:
+            default = repr(f.default)
+        elif f.default_factory is not dataclasses.MISSING:
+            default = repr(f.default_factory())
+        else:
+            # the repr of MISSING contains its address, which changes between processes
+            default = None
+        nested = _describe_schema(f.type) if dataclasses.is_dataclass(f.type) else None
+        fields.append((f.name, repr(f.type), default, nested))
+    return (schema.__module__, schema.__qualname__, tuple(fields))
+
+
+@functools.lru_cache(maxsize=None)
+def _schema_fingerprint() -> str:
+    """
+    Short hash over the registered schemas and the omegaconf and hydra versions, a pickled config is only valid for
+    the ones it was composed and pickled with.
+    """
+    schemas = sorted(
+        {_describe_schema(s) for s in (*_NAME_TO_NODE.values(), *_GROUP_NODES.values())}, key=repr
+    )
+    key = (omegaconf.__version__, hydra.__version__, schemas)
+    return hashlib.blake2b(repr(key).encode(), digest_size=8).hexdigest()
+
+
+def _conf_fingerprint() -> str:
+    """
+    Short hash over the paths and modification times of all yaml files in the conf dir, and the schema fingerprint.
+    """
+    entries = []
+    dirs = [_CONF_DIR]
+    while dirs:
+        with os.scandir(dirs.pop()) as it:
+            for entry in it:
+                if entry.is_dir():
+                    dirs.append(entry.path)
+                elif entry.name.endswith(".yaml"):
+                    entries.append((entry.path, entry.stat().st_mtime_ns))
+    return hashlib.blake2b(repr((sorted(entries), _schema_fingerprint())).encode(), digest_size=8).hexdigest()
+
+
+def _cache_path(name: str) -> str:
+    return os.path.join(_CACHE_DIR, f"{name}-{_conf_fingerprint()}.pkl")
+
+
+_config_loader = None
+
+
+def _get_config_loader():
+    """
+    Hydra's config loader for the conf dir, created once and reused by all loads. None when hydra's internal API
+    doesn't match.
+    """
+    global _config_loader
+    if _config_loader is None:
+        try:
+            from hydra._internal.config_loader_impl import ConfigLoaderImpl
+            from hydra._internal.utils import create_config_search_path
+        except ImportError:
+            return None
+        _config_loader = ConfigLoaderImpl(
+            config_search_path=create_config_search_path(f"file://{_CONF_DIR}")
+        )
+    return _config_loader
+
+
+def _compose_config(name):
+    loader = _get_config_loader()
+    if loader is None:
+        # an absolute dir, so hydra doesn't inspect the call stack to resolve the caller's file
+        with initialize_config_dir(config_dir=_CONF_DIR, version_base=None):
+            return compose(config_name=name)
+
+    # same as compose() does through the global hydra instance initialize sets up
+    cfg = loader.load_configuration(config_name=name, overrides=[], run_mode=RunMode.RUN, from_shell=False)
+    if "hydra" in cfg:
+        with open_dict(cfg):
+            del cfg["hydra"]
+    return cfg
+
+
+@functools.lru_cache(maxsize=32)
+def _load_config(name):
+    yaml_repr = None
+    if os.environ.get("MPPIISAAC_CONFIG_CACHE") != "1":
+        cfg = _compose_config(name)
+    else:
+        path = _cache_path(name)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                cached = pickle.load(f)
+            # files written before the yaml dump was cached hold the bare config
+            cfg, yaml_repr = cached if isinstance(cached, tuple) else (cached, None)
+        else:
+            cfg = _compose_config(name)
+            OmegaConf.resolve(cfg)
+            # dumped once here, so a debug log of a cache hit doesn't run the yaml dumper again
+            yaml_repr = OmegaConf.to_yaml(cfg)
+            os.makedirs(_CACHE_DIR, exist_ok=True)
+            # write under a temporary name, so a concurrent reader never sees a partial pickle
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump((cfg, yaml_repr), f, protocol=5)
+            os.replace(tmp_path, path)
+
+    # interned, comparisons and dict lookups on the actor names downstream can match by identity
+    if "actors" in cfg and OmegaConf.is_list(cfg.actors):
+        cfg.actors = [sys.intern(a) for a in cfg.actors]
+
+    logger.info("loaded config %s: keys=%s", name, list(cfg.keys()))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s", yaml_repr if yaml_repr is not None else OmegaConf.to_yaml(cfg))
+    # shared by all callers, so nobody may modify it
+    OmegaConf.set_readonly(cfg, True)
+    return cfg
+
+
+@functools.lru_cache(maxsize=32)
+def _load_config_object(name):
+    cfg = _load_config(name)
+    if OmegaConf.get_type(cfg) is not _NAME_TO_NODE.get(name, ExampleConfig):
+        # validate against and convert to the schema registered for the name
+        cfg = OmegaConf.merge(OmegaConf.structured(_NAME_TO_NODE.get(name, ExampleConfig)), cfg)
+    return OmegaConf.to_object(cfg)
+
+
+def load_isaacgym_config(name, readonly=False, as_object=False):
+    """
+    Configs are composed once per process and name. By default a copy that can be modified is returned, as
+    MPPIisaacPlanner needs (update_mppi_params writes to cfg.mppi). With readonly=True the config shared by all
+    callers is returned instead, read only so nobody can change it for the others; only pass it to code that doesn't
+    write to it.
+
+    With as_object the config is returned fully resolved as an ExampleConfig instance instead of a DictConfig, so
+    attribute reads are plain python attribute loads. Unlike the DictConfig the shared instance can't be made read
+    only, so don't modify it unless readonly=False.
+
+    With MPPIISAAC_CONFIG_CACHE=1 the resolved config is pickled to ~/.cache/mppiisaac and reused until a yaml file in
+    the conf dir changes, skipping hydra entirely.
+    """
+    _register_configs((name,))
+    if as_object:
+        cfg = _load_config_object(name)
+        return cfg if readonly else copy.deepcopy(cfg)
+
+    cfg = _load_config(name)
+    if readonly:
+        return cfg
+    cfg = copy.deepcopy(cfg)
+    OmegaConf.set_readonly(cfg, False)
+    return cfg
@@ -0,0 +1,102 @@
+from mppiisaac.planner.isaacgym_wrapper import IsaacGymConfig
+from mppiisaac.utils import config_store
+from mppiisaac.utils.config_store import ExampleConfig, load_isaacgym_config
+from omegaconf import OmegaConf
+from omegaconf.errors import ReadonlyConfigError
+import omegaconf._utils
+import os
+import pytest
+import yaml
+
+TEST_CONFIG = """
+defaults:
+  - mppi: base_mppi
+  - isaacgym: base_isaacgym
+  - _self_
+
+render: false
+n_steps: 5
+nx: 4
+goal: [1.0, 2.0]
+actors: [point_robot]
+initial_actor_positions: [[0.0, 0.0, 0.05]]
+"""
+
+
+@pytest.fixture
+def conf_dir(tmp_path, monkeypatch):
+    conf = tmp_path / "conf"
+    conf.mkdir()
+    (conf / "test_config.yaml").write_text(TEST_CONFIG)
+    monkeypatch.setattr(config_store, "_CONF_DIR", str(conf))
+    monkeypatch.setattr(config_store, "_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(config_store, "_config_loader", None)
+    monkeypatch.delenv("MPPIISAAC_CONFIG_CACHE", raising=False)
+    config_store._load_config.cache_clear()
+    config_store._load_config_object.cache_clear()
+    yield conf
+    config_store._load_config.cache_clear()
+    config_store._load_config_object.cache_clear()
+
+
+def test_disk_cache_invalidation(conf_dir, monkeypatch) -> None:
+    monkeypatch.setenv("MPPIISAAC_CONFIG_CACHE", "1")
+    assert load_isaacgym_config("test_config").n_steps == 5
+    assert len(os.listdir(config_store._CACHE_DIR)) == 1
+
+    # an unchanged conf dir is served from the pickle
+    config_store._load_config.cache_clear()
+    assert load_isaacgym_config("test_config").n_steps == 5
+    assert len(os.listdir(config_store._CACHE_DIR)) == 1
+
+    path = conf_dir / "test_config.yaml"
+    path.write_text(TEST_CONFIG.replace("n_steps: 5", "n_steps: 7"))
+    # move the mtime explicitly, the filesystem's timestamps may be too coarse to tell both writes apart
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    config_store._load_config.cache_clear()
+    assert load_isaacgym_config("test_config").n_steps == 7
+    assert len(os.listdir(config_store._CACHE_DIR)) == 2
+
+
+def test_modified_copy_does_not_leak(conf_dir) -> None:
+    # the default is a writable copy, e.g. MPPIisaacPlanner.update_mppi_params writes to cfg.mppi
+    cfg = load_isaacgym_config("test_config")
+    cfg.n_steps = 100
+    cfg.actors.append("box")
+    cfg.mppi.noise_sigma = [[1.0, 0.0], [0.0, 1.0]]
+
+    shared = load_isaacgym_config("test_config", readonly=True)
+    assert shared.n_steps == 5
+    assert list(shared.actors) == ["point_robot"]
+    with pytest.raises(ReadonlyConfigError):
+        shared.n_steps = 100
+
+    assert load_isaacgym_config("test_config").n_steps == 5
+
+
+def test_as_object(conf_dir) -> None:
+    cfg = load_isaacgym_config("test_config", as_object=True, readonly=True)
+    assert isinstance(cfg, ExampleConfig)
+    assert isinstance(cfg.isaacgym, IsaacGymConfig)
+    assert cfg.goal == [1.0, 2.0]
+    assert cfg.initial_actor_positions == [[0.0, 0.0, 0.05]]
+
+    assert load_isaacgym_config("test_config", as_object=True, readonly=True) is cfg
+    copy = load_isaacgym_config("test_config", as_object=True)
+    assert copy is not cfg
+    assert copy == cfg
+
+
+def test_libyaml_loader() -> None:
+    if not hasattr(yaml, "CSafeLoader"):
+        pytest.skip("pyyaml built without libyaml")
+    assert issubclass(omegaconf._utils.get_yaml_loader(), yaml.CSafeLoader)
+
+    # same results as OmegaConf's own loader, including its float resolver and duplicate key check
+    cfg = OmegaConf.create("a: 1e3\nb: 2019-01-01\nc: [1, 2]")
+    assert cfg.a == 1000.0
+    assert cfg.b == "2019-01-01"
+    with pytest.raises(yaml.constructor.ConstructorError):
+        OmegaConf.create("a: 1\na: 2")
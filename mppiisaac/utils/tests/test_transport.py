@@ -0,0 +1,108 @@
+from mppiisaac.utils.transport import (
+    ActionClient,
+    ActionServer,
+    SharedTensor,
+    bytes_to_torch,
+    torch_to_bytes,
+)
+import gevent
+import pytest
+import threading
+import torch
+
+
+def test_shared_tensor() -> None:
+    owner = SharedTensor.create((2, 13), torch.float32)
+    remote = SharedTensor.attach(owner.spec())
+
+    assert remote.tensor.size() == torch.Size([2, 13])
+    assert remote.tensor.dtype == torch.float32
+
+    state = torch.rand((2, 13))
+    owner.tensor.copy_(state)
+    assert torch.equal(remote.tensor, state)
+
+    remote.close()
+    owner.close()
+
+
+def test_bytes_roundtrip() -> None:
+    t = torch.rand((4, 3, 13))
+    assert torch.equal(bytes_to_torch(torch_to_bytes(t)), t)
+
+    # a slice should only serialize its own elements, not the full storage
+    view = t[1:2, :, 0:3]
+    b = torch_to_bytes(view)
+    assert torch.equal(bytes_to_torch(b), view)
+    assert len(b) < view.numel() * view.element_size() + 64
+
+
+def test_bytes_roundtrip_writable() -> None:
+    t = torch.rand((2, 3))
+    decoded = bytes_to_torch(torch_to_bytes(t))
+    decoded += 1.0
+    assert torch.equal(decoded, t + 1.0)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="needs a cuda device")
+def test_bytes_roundtrip_device() -> None:
+    t = torch.rand((2, 3), device="cuda:0")
+    b = torch_to_bytes(t)
+    # the receiver picks the device, the sender's isn't part of the format
+    assert bytes_to_torch(b).device == torch.device("cpu")
+    decoded = bytes_to_torch(b, device=t.device)
+    assert decoded.device == t.device
+    assert torch.equal(decoded, t)
+
+    out = torch.empty((2, 3), device="cuda:0")
+    assert bytes_to_torch(b, out=out) is out
+    assert torch.equal(out, t)
+
+
+def test_unsupported_dtype() -> None:
+    with pytest.raises(TypeError, match="complex64"):
+        torch_to_bytes(torch.zeros(2, dtype=torch.complex64))
+
+
+def test_bytes_to_torch_out() -> None:
+    t = torch.rand((1, 8))
+    out = torch.empty((8,))
+    assert bytes_to_torch(torch_to_bytes(t), out=out) is out
+    assert torch.equal(out, t[0])
+
+
+class _FailingPlanner:
+    def __init__(self):
+        self.calls = 0
+
+    def compute_action_shared(self):
+        self.calls += 1
+        if self.calls == 1:
+            raise ValueError("planner failed")
+        return 3
+
+
+def test_action_server_error_reply(tmp_path) -> None:
+    endpoint = f"ipc://{tmp_path / 'action.sock'}"
+    planner = _FailingPlanner()
+    server = ActionServer(planner, endpoint).spawn()
+
+    results = []
+
+    def client():
+        action_client = ActionClient(endpoint, timeout=5.0)
+        for _ in range(2):
+            try:
+                results.append(action_client.compute_action())
+            except RuntimeError as e:
+                results.append(e)
+
+    # the server runs on the gevent loop of this thread, the blocking client in its own thread
+    thread = threading.Thread(target=client)
+    thread.start()
+    while thread.is_alive():
+        gevent.sleep(0.01)
+    server.kill()
+
+    assert isinstance(results[0], RuntimeError)
+    assert results[1] == 3
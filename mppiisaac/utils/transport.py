@@ -1,14 +1,239 @@
 import torch
-import io
+import gevent
+import logging
+import numpy as np
+import os
+import pickle
+import struct
+import warnings
+import zmq
+import zmq.green
+from torch.multiprocessing.reductions import reduce_tensor
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+_NUMPY_DTYPES = {
+    torch.float16: np.float16,
+    torch.float32: np.float32,
+    torch.float64: np.float64,
+    torch.int32: np.int32,
+    torch.int64: np.int64,
+    torch.bool: np.bool_,
+}
+
+# Wire format: header (dtype id, ndim, nbytes), ndim uint32 dims, raw little endian data
+_DTYPES = tuple(_NUMPY_DTYPES)
+_HEADER = struct.Struct("<BII")
+
+
+def _dtype_id(dtype: torch.dtype) -> int:
+    try:
+        return _DTYPES.index(dtype)
+    except ValueError:
+        raise TypeError(f"Unsupported dtype {dtype}, expected one of {_DTYPES}") from None
 
 
 def torch_to_bytes(t: torch.Tensor) -> bytes:
-    buff = io.BytesIO()
-    torch.save(t, buff)
-    buff.seek(0)
-    return buff.read()
+    # contiguous() so a sliced view never serializes the whole storage it is based on
+    arr = t.detach().contiguous().cpu().numpy()
+    return b"".join(
+        (
+            _HEADER.pack(_dtype_id(t.dtype), arr.ndim, arr.nbytes),
+            struct.pack(f"<{arr.ndim}I", *arr.shape),
+            arr.data.cast("B"),
+        )
+    )
+
+
+def bytes_to_torch(
+    b: bytes, out: Optional[torch.Tensor] = None, device: Optional[torch.device] = None
+) -> torch.Tensor:
+    """
+    Returns a writable tensor on device, the cpu by default. The sender's device isn't part of the format, the
+    processes may not see the same devices. When out is given, e.g. a preallocated pinned staging tensor or the
+    destination itself, the data is copied into it instead and out is returned.
+    """
+    dtype_id, ndim, nbytes = _HEADER.unpack_from(b)
+    shape = struct.unpack_from(f"<{ndim}I", b, _HEADER.size)
+    dtype = _DTYPES[dtype_id]
+    np_dtype = np.dtype(_NUMPY_DTYPES[dtype])
+    arr = np.frombuffer(
+        b, dtype=np_dtype, count=nbytes // np_dtype.itemsize, offset=_HEADER.size + 4 * ndim
+    )
+    return _copy_from_buffer(arr.reshape(shape), dtype, out, device)
+
+
+def _copy_from_buffer(
+    arr: np.ndarray, dtype: torch.dtype, out: Optional[torch.Tensor], device: Optional[torch.device] = None
+) -> torch.Tensor:
+    """
+    Single copy from the read-only received buffer arr into out, or into a new tensor on device.
+    """
+    if out is None:
+        out = torch.empty(arr.shape, dtype=dtype, device=device)
+    if out.device.type == "cpu":
+        np.copyto(out.numpy(), arr.reshape(out.shape))
+        return out
+    # only read as the source of the upload, so the tensor being read-only doesn't matter here
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="The given NumPy array is not writable")
+        src = torch.from_numpy(arr)
+    return out.copy_(src.view_as(out))
+
+
+class SharedTensor:
+    """
+    CPU tensor backed by a named shared memory segment, so the planner and world
+    processes on the same host read and write the same physical pages instead of
+    serializing the tensor over zerorpc every step.
+
+    One process creates the segment and hands its spec() to the other process,
+    which attaches to it. Only the creator unlinks the segment on close.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, shape: Sequence[int], dtype: str, owner: bool):
+        self._shm = shm
+        self._owner = owner
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.tensor = torch.from_numpy(np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf))
+
+    @classmethod
+    def create(cls, shape: Sequence[int], dtype: torch.dtype = torch.float32) -> "SharedTensor":
+        np_dtype = np.dtype(_NUMPY_DTYPES[dtype])
+        nbytes = max(int(np.prod(shape)) * np_dtype.itemsize, 1)
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        return cls(shm, shape, np_dtype.str, owner=True)
+
+    @classmethod
+    def attach(cls, spec: dict) -> "SharedTensor":
+        shm = shared_memory.SharedMemory(name=spec["name"])
+        # The creator owns the segment, don't let this process' tracker unlink it at exit
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, spec["shape"], spec["dtype"], owner=False)
+
+    def spec(self) -> dict:
+        return {"name": self._shm.name, "shape": list(self.shape), "dtype": self.dtype.str}
+
+    def close(self):
+        del self.tensor
+        try:
+            self._shm.close()
+        except BufferError:
+            # A view of the tensor is still alive, the mapping is released once it is garbage collected
+            pass
+        if self._owner:
+            self._shm.unlink()
+
+
+class SharedCudaTensor:
+    """
+    Same interface as SharedTensor, but the tensor stays in device memory and the other process maps it through a
+    CUDA IPC handle. The creator has to keep the object alive for as long as the other process uses the tensor.
+    """
+
+    def __init__(self, tensor: torch.Tensor, handle: bytes, owner: bool):
+        self._handle = handle
+        self._owner = owner
+        self.shape = tuple(tensor.shape)
+        self.tensor = tensor
+
+    @classmethod
+    def create(
+        cls, shape: Sequence[int], dtype: torch.dtype = torch.float32, device: str = "cuda:0"
+    ) -> "SharedCudaTensor":
+        tensor = torch.zeros(shape, dtype=dtype, device=device)
+        return cls(tensor, pickle.dumps(reduce_tensor(tensor)), owner=True)
+
+    @classmethod
+    def attach(cls, spec: dict) -> "SharedCudaTensor":
+        rebuild, args = pickle.loads(spec["cuda_ipc"])
+        return cls(rebuild(*args), spec["cuda_ipc"], owner=False)
+
+    def spec(self) -> dict:
+        return {"cuda_ipc": self._handle, "shape": list(self.shape)}
+
+    def close(self):
+        del self.tensor
+
+
+def attach_shared_tensor(spec: dict):
+    if "cuda_ipc" in spec:
+        return SharedCudaTensor.attach(spec)
+    return SharedTensor.attach(spec)
+
+
+def remove_stale_ipc_endpoint(endpoint: str):
+    """
+    Remove the socket file a killed process may have left behind for an ipc:// endpoint, call it before binding.
+    """
+    if endpoint.startswith("ipc://") and os.path.exists(endpoint[len("ipc://"):]):
+        os.remove(endpoint[len("ipc://"):])
+
+
+# Reply of the action socket, the number of valid rollout steps or _ACTION_FAILED
+_N_ROLLOUT_STEPS = struct.Struct("<i")
+_ACTION_FAILED = -1
+
+
+class ActionServer:
+    """
+    Bare ZMQ REP socket serving compute_action_shared of a planner, so the per step call skips zerorpc's envelope and
+    heartbeats. zerorpc keeps serving the control messages (handshake, weights, ...) next to it. The socket is a
+    zmq.green one, so it cooperates with the gevent loop of the zerorpc server in the same process.
+    """
+
+    def __init__(self, planner, endpoint: str):
+        self._planner = planner
+        self._socket = zmq.green.Context.instance().socket(zmq.REP)
+        self._socket.setsockopt(zmq.LINGER, 0)
+        self._socket.bind(endpoint)
+
+    def run(self):
+        while True:
+            self._socket.recv(copy=False)
+            # always reply, a REP socket that skips one can't receive the next request and the client would only see
+            # a timeout
+            try:
+                n_rollout_steps = self._planner.compute_action_shared()
+            except Exception:
+                logger.exception("compute_action_shared failed")
+                n_rollout_steps = _ACTION_FAILED
+            self._socket.send(_N_ROLLOUT_STEPS.pack(n_rollout_steps), copy=False)
+
+    def spawn(self) -> gevent.Greenlet:
+        return gevent.spawn(self.run)
+
+
+class ActionClient:
+    """
+    Client side of ActionServer. Like zmq sockets this is not thread safe, create one client per thread.
+    """
+
+    def __init__(self, endpoint: str, timeout: float = 30.0):
+        self._endpoint = endpoint
+        self._timeout_ms = int(timeout * 1000)
+        self._connect()
 
+    def _connect(self):
+        self._socket = zmq.Context.instance().socket(zmq.REQ)
+        self._socket.setsockopt(zmq.LINGER, 0)
+        self._socket.connect(self._endpoint)
 
-def bytes_to_torch(b: bytes) -> torch.Tensor:
-    buff = io.BytesIO(b)
-    return torch.load(buff)
+    def compute_action(self) -> int:
+        """
+        Let the planner compute the next action from the shared state buffers, returns the number of valid rollout steps.
+        Raises a TimeoutError when the planner doesn't reply in time and a RuntimeError when it failed to compute one.
+        """
+        self._socket.send(b"act", copy=False)
+        if not self._socket.poll(self._timeout_ms):
+            # a REQ socket cannot send again before it got its reply, start over with a new one
+            self._socket.close()
+            self._connect()
+            raise TimeoutError("No reply from the planner")
+        n_rollout_steps = _N_ROLLOUT_STEPS.unpack(self._socket.recv())[0]
+        if n_rollout_steps == _ACTION_FAILED:
+            raise RuntimeError("The planner failed to compute an action, see its log")
+        return n_rollout_steps